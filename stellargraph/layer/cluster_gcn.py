@@ -14,6 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import tensorflow as tf
 from tensorflow.keras import backend as K
 from tensorflow.keras import activations, initializers, constraints, regularizers
 from tensorflow.keras.layers import Input, Layer, Lambda, Dropout, Reshape
@@ -42,7 +43,8 @@ class ClusterGraphConvolution(Layer):
         and the normalized graph adjacency matrix.
 
       - This class assumes that the normalized graph adjacency matrix is passed as
-        input to the Keras methods.
+        input to the Keras methods. The matrix can be given either as a dense matrix
+        or as two tensors containing the indices and values of its non-zero entries.
 
       - The output indices are used when ``final_layer=True`` and the returned outputs
         are the final-layer features for the nodes indexed by output indices.
@@ -181,12 +183,14 @@ class ClusterGraphConvolution(Layer):
         Applies the layer.
 
         Args:
-            inputs (list): a list of 3 input tensors that includes
+            inputs (list): a list of 3 or 4 input tensors that includes
                 node features (size 1 x N x F),
                 output indices (size 1 x M)
-                graph adjacency matrix (size 1 x N x N),
-                where N is the number of nodes in the graph, and
-                F is the dimensionality of node features.
+                graph adjacency matrix (size N x N), or the indices (size E x 2)
+                and values (size E) of the non-zero entries of the adjacency matrix,
+                where N is the number of nodes in the graph,
+                F is the dimensionality of node features, and
+                E is the number of non-zero entries in the adjacency matrix.
 
         Returns:
             Keras Tensor that represents the output of the layer.
@@ -197,9 +201,21 @@ class ClusterGraphConvolution(Layer):
         features = K.squeeze(features, 0)
         out_indices = K.squeeze(out_indices, 0)
 
+        if len(As) == 2:
+            # The number of nodes varies between mini-batches so the shape of the sparse
+            # matrix is taken from the node features
+            A_indices, A_values = As
+            n_nodes = K.shape(features)[0]
+            A = tf.SparseTensor(
+                indices=K.cast(A_indices, "int64"),
+                values=A_values,
+                dense_shape=K.cast(K.stack([n_nodes, n_nodes]), "int64"),
+            )
+        else:
+            A = As[0]
+
         # Calculate the layer operation of GCN multiplying the normalized adjacency matrix
         # width the node features matrix.
-        A = As[0]
         h_graph = K.dot(A, features)
         output = K.dot(h_graph, self.kernel)
 
@@ -285,6 +301,9 @@ class ClusterGCN:
         self.generator = generator
         self.support = 1
 
+        # Check if the generator is producing a sparse matrix
+        self.use_sparse = generator.use_sparse
+
         # Optional regulariser, etc. for weights and biases
         self._get_regularisers_from_keywords(kwargs)
 
@@ -326,9 +345,15 @@ class ClusterGCN:
         The input tensors are expected to be a list of the following:
         [
             Node features shape (1, N, F),
+            Output indices (1, O),
             Adjacency indices (1, E, 2),
-            Adjacency values (1, E),
-            Output indices (1, O)
+            Adjacency values (1, E)
+        ]
+        or, if the generator supplies a dense adjacency matrix,
+        [
+            Node features shape (1, N, F),
+            Output indices (1, O),
+            Adjacency matrix (1, N, N)
         ]
         where N is the number of nodes, F the number of input features,
               E is the number of edges, O the number of output nodes.
@@ -372,9 +397,17 @@ class ClusterGCN:
         x_t = Input(batch_shape=(1, None, N_feat))
         out_indices_t = Input(batch_shape=(1, None, None), dtype="int32")
 
-        # Placeholders for the dense adjacency matrix
-        A_m = Input(batch_shape=(1, None, None))
-        A_placeholders = [A_m]
+        # Create inputs for sparse or dense matrices
+        if self.use_sparse:
+            # Placeholders for the sparse adjacency matrix
+            A_indices_t = Input(batch_shape=(1, None, 2), dtype="int64")
+            A_values_t = Input(batch_shape=(1, None))
+            A_placeholders = [A_indices_t, A_values_t]
+
+        else:
+            # Placeholders for the dense adjacency matrix
+            A_m = Input(batch_shape=(1, None, None))
+            A_placeholders = [A_m]
 
         x_inp = [x_t, out_indices_t] + A_placeholders
         x_out = self(x_inp)
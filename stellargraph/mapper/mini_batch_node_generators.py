@@ -20,17 +20,37 @@ Mappers to provide input data for the graph models in layers.
 """
 __all__ = ["ClusterNodeGenerator", "ClusterNodeSequence"]
 
-import random
-import copy
 import numpy as np
 import networkx as nx
+import scipy.sparse as sps
+import tensorflow as tf
 from tensorflow.keras.utils import Sequence
 
-from scipy import sparse
 from ..core.graph import StellarGraphBase
 from ..core.utils import is_real_iterable
 
 
+def _index_dtype(max_value):
+    """
+    Returns the smallest of int32 and int64 that holds indices up to max_value.
+    """
+    return np.int32 if max_value <= np.iinfo(np.int32).max else np.int64
+
+
+def _compact_csr(A):
+    """
+    Returns the CSR matrix A with int32 column indices and row pointers, if they fit.
+    """
+    index_dtype = _index_dtype(max(A.shape + (A.nnz,)))
+    if A.indices.dtype == index_dtype and A.indptr.dtype == index_dtype:
+        return A
+
+    return sps.csr_matrix(
+        (A.data, A.indices.astype(index_dtype), A.indptr.astype(index_dtype)),
+        shape=A.shape,
+    )
+
+
 class ClusterNodeGenerator:
     """
     A data generator for use with ClusterGCN models on homogeneous graphs, [1].
@@ -42,7 +62,9 @@ class ClusterNodeGenerator:
     to get an object that can be used as a Keras data generator.
 
     This generator will supply the features array and the adjacency matrix to a
-    mini-batch Keras graph ML model.
+    mini-batch Keras graph ML model. There is a choice to supply either a sparse
+    adjacency matrix (the default) or a dense adjacency matrix, with the `sparse`
+    argument.
 
     [1] `W. Chiang, X. Liu, S. Si, Y. Li, S. Bengio, C. Hsieh, 2019 <https://arxiv.org/abs/1905.07953>`_.
 
@@ -57,10 +79,14 @@ class ClusterNodeGenerator:
             in G. The clusters should be non-overlapping.
         q (float): The number of clusters to combine for each mini-batch. The default is 1.
         lam (float): The mixture coefficient for adjacency matrix normalisation.
+        sparse (bool): If True (default) a sparse adjacency matrix is used,
+            if False a dense adjacency matrix is used.
+        seed (int, optional): Random seed for the random clusters and for shuffling the
+            clusters in the sequences created by :meth:`flow`.
         name (str): an optional name of the generator
     """
 
-    def __init__(self, G, clusters=1, q=1, lam=0.1, name=None):
+    def __init__(self, G, clusters=1, q=1, lam=0.1, sparse=True, seed=None, name=None):
 
         if not isinstance(G, StellarGraphBase):
             raise TypeError("Graph must be a StellarGraph object.")
@@ -70,6 +96,8 @@ class ClusterNodeGenerator:
         self.q = q  # The number of clusters to sample per mini-batch
         self.lam = lam
         self.clusters = clusters
+        self.use_sparse = sparse
+        self._random_state = np.random.RandomState(seed=seed)
 
         if isinstance(clusters, list):
             self.k = len(clusters)
@@ -130,8 +158,10 @@ class ClusterNodeGenerator:
         if isinstance(clusters, int):
             # We are not given graph clusters.
             # We are going to split the graph into self.k random clusters
-            all_nodes = list(G.nodes())
-            random.shuffle(all_nodes)
+            all_nodes = [
+                self.node_list[i]
+                for i in self._random_state.permutation(len(self.node_list))
+            ]
             cluster_size = len(all_nodes) // self.k
             self.clusters = [
                 all_nodes[i : i + cluster_size]
@@ -147,8 +177,16 @@ class ClusterNodeGenerator:
         for i, c in enumerate(self.clusters):
             print(f"{i} cluster has size {len(c)}")
 
-        # Get the features for the nodes
-        self.features = G.get_feature_for_nodes(self.node_list)
+        # The adjacency matrix and the features of the whole graph are shared by all
+        # the sequences created by flow
+        self.Aadj = _compact_csr(
+            nx.to_scipy_sparse_matrix(
+                G, nodelist=self.node_list, dtype="float32", format="csr"
+            )
+        )
+        self.features = np.ascontiguousarray(
+            G.get_feature_for_nodes(self.node_list), dtype=np.float32
+        )
 
     def flow(self, node_ids, targets=None, name=None):
         """
@@ -191,6 +229,11 @@ class ClusterNodeGenerator:
             node_ids=node_ids,
             q=self.q,
             lam=self.lam,
+            sparse=self.use_sparse,
+            node_list=self.node_list,
+            features=self.features,
+            Aadj=self.Aadj,
+            seed=self._random_state.randint(np.iinfo(np.int32).max),
             name=name,
         )
 
@@ -205,6 +248,9 @@ class ClusterNodeSequence(Sequence):
     This class should be created using the `.flow(...)` method of
     :class:`ClusterNodeGenerator`.
 
+    The :meth:`to_dataset` method wraps this sequence in a ``tf.data.Dataset`` that
+    prepares the next mini-batches while the model processes the current one.
+
     Args:
         graph (StellarGraph): The graph
         clusters (list): A list of lists such that each sub-list indicates the nodes in a cluster.
@@ -218,6 +264,16 @@ class ClusterNodeSequence(Sequence):
             1 such that the generator treats each subgraph as a batch.
         lam (float, optional): The mixture coefficient for adjacency matrix normalisation (the
             'diagonal enhancement' method). Valid values are in the interval [0, 1] and the default value is 0.1.
+        sparse (bool, optional): If True (default) the adjacency matrix for each mini-batch is supplied
+            as a list of indices and values of its non-zero entries, otherwise it is supplied as a
+            dense matrix.
+        node_list (list, optional): The node IDs of the graph in the order of the rows of
+            `features` and `Aadj`. If not given, it is taken from the graph.
+        features (np.ndarray, optional): The features of all the nodes in the graph, in the
+            order of `node_list`. If not given, they are taken from the graph.
+        Aadj (scipy.sparse.csr_matrix, optional): The adjacency matrix of the whole graph,
+            in the order of `node_list`. If not given, it is computed from the graph.
+        seed (int, optional): Random seed for shuffling the clusters at the end of each epoch.
         name (str, optional): An optional name for this generator object.
     """
 
@@ -230,20 +286,65 @@ class ClusterNodeSequence(Sequence):
         normalize_adj=True,
         q=1,
         lam=0.1,
+        sparse=True,
+        node_list=None,
+        features=None,
+        Aadj=None,
+        seed=None,
         name=None,
     ):
 
         self.name = name
         self.clusters = list()
-        self.clusters_original = copy.deepcopy(clusters)
+        # The clusters are never modified so a shallow copy is sufficient
+        self.clusters_original = tuple(clusters)
         self.graph = graph
-        self.node_list = list(graph.nodes())
+
+        if node_list is None:
+            if features is not None or Aadj is not None:
+                raise ValueError(
+                    "node_list must be given when features or Aadj are given."
+                )
+            node_list = list(graph.nodes())
+        self.node_list = node_list
+
+        # The adjacency matrix of each cluster is sliced from the sparse adjacency
+        # matrix of the whole graph
+        if Aadj is None:
+            Aadj = nx.to_scipy_sparse_matrix(
+                graph, nodelist=self.node_list, dtype="float32", format="csr"
+            )
+        self.Aadj = _compact_csr(Aadj)
+
+        # Node indices are stored as int32 when they fit, to halve the memory traffic
+        self._index_dtype = _index_dtype(len(self.node_list))
+        self._node_index = dict(zip(self.node_list, range(len(self.node_list))))
+
+        # Integer node IDs are kept in an integer array, and other node IDs in an object
+        # array that keeps them unchanged (e.g. tuples, or mixed types)
+        node_ids_array = np.asarray(self.node_list)
+        if not (
+            node_ids_array.ndim == 1 and np.issubdtype(node_ids_array.dtype, np.integer)
+        ):
+            node_ids_array = np.empty(len(self.node_list), dtype=object)
+            for i, node_id in enumerate(self.node_list):
+                node_ids_array[i] = node_id
+
+        # The node IDs as an array, to find the IDs of the target nodes in each cluster
+        self._node_ids_array = node_ids_array
+
+        # The features of each cluster are gathered from the features of the whole graph
+        if features is None:
+            features = graph.get_feature_for_nodes(self.node_list)
+        self.features = np.ascontiguousarray(features, dtype=np.float32)
         self.normalize_adj = normalize_adj
+        self.use_sparse = sparse
+        self._random_state = np.random.RandomState(seed=seed)
         self.q = q
         self.lam = lam
         self.node_order = list()
         self._node_order_in_progress = list()
-        self.__node_buffer = dict()
+        self.__node_buffer = list()
         self.target_ids = list()
 
         if len(clusters) % self.q != 0:
@@ -268,108 +369,285 @@ class ClusterNodeSequence(Sequence):
                 )
 
             self.targets = np.asanyarray(targets)
-            self.target_node_lookup = dict(
-                zip(self.target_ids, range(len(self.target_ids)))
-            )
         else:
             self.targets = None
 
+        # Mask of the target nodes in the node list of the graph and, for target nodes,
+        # the index of the node in the target IDs (the row of the targets array).
+        # Target IDs that are not in the graph are ignored.
+        target_node_indices, target_found = self._node_indices(self.target_ids)
+        self._is_target = np.zeros(len(self.node_list), dtype=bool)
+        self._is_target[target_node_indices] = True
+        self._target_lookup = np.full(len(self.node_list), -1, dtype=self._index_dtype)
+        self._target_lookup[target_node_indices] = np.nonzero(target_found)[0]
+
+        # The indices of the nodes of each cluster in the node list of the graph,
+        # ignoring the nodes that are not in the graph
+        self._cluster_node_indices = [
+            self._node_indices(cluster)[0] for cluster in self.clusters_original
+        ]
+
+        # When q is 1 each mini-batch is one of the given clusters, so the adjacency
+        # matrix of each cluster is computed once and reused every epoch
+        self._cluster_cache = None
+        if self.q == 1:
+            self._cluster_cache = [
+                self._cluster_adjacency(node_indices)
+                for node_indices in self._cluster_node_indices
+            ]
+            # The sparse mini-batch values are views of the cached matrices, so they
+            # are made read-only to keep the cache from being changed through them
+            for adj_cluster in self._cluster_cache:
+                adj_cluster.data.flags.writeable = False
+
         self.on_epoch_end()
 
     def __len__(self):
         num_batches = len(self.clusters_original) // self.q
         return num_batches
 
-    def __getitem__(self, index):
-        # The next batch should be the adjacency matrix for the cluster and the corresponding feature vectors
-        # and targets if available.
-        cluster = self.clusters[index]
-        g_cluster = self.graph.subgraph(
-            cluster
-        )  # Get the subgraph; returns SubGraph view
+    def _node_indices(self, node_ids):
+        """
+        Finds the indices of the given nodes in the node list of the graph.
+
+        Args:
+            node_ids (iterable): The node IDs
+
+        Returns:
+            A tuple of an array of the indices of the nodes that are in the graph, and a
+            boolean mask of the given node IDs that are in the graph.
+        """
+        # Look up each node, with -1 for nodes that are not in the graph
+        node_indices = np.fromiter(
+            (self._node_index.get(n, -1) for n in node_ids),
+            dtype=self._index_dtype,
+            count=len(node_ids),
+        )
+        found = node_indices >= 0
+        return node_indices[found], found
+
+    def _cluster_adjacency(self, node_indices):
+        """
+        Computes the (optionally normalized) adjacency matrix of the nodes in a cluster.
+
+        Args:
+            node_indices (np.ndarray): The indices of the cluster nodes in the node list
+                of the graph
 
-        adj_cluster = nx.adjacency_matrix(
-            g_cluster
-        )  # order is given by order of IDs in cluster
+        Returns:
+            The adjacency matrix as a scipy sparse matrix with rows in the order
+            of the given node indices.
+        """
+        # order is given by order of IDs in cluster
+        adj_cluster = self.Aadj[node_indices][:, node_indices]
 
-        # The operations to normalize the adjacency matrix are too slow.
-        # Either optimize this or implement as a layer(?)
         if self.normalize_adj:
             # add self loops
             adj_cluster.setdiag(1)  # add self loops
-            degree_matrix_diag = 1.0 / (adj_cluster.sum(axis=1) + 1)
-            degree_matrix_diag = np.squeeze(np.asarray(degree_matrix_diag))
-            degree_matrix = sparse.lil_matrix(adj_cluster.shape)
-            degree_matrix.setdiag(degree_matrix_diag)
-            adj_cluster = degree_matrix.tocsr() @ adj_cluster
-            adj_cluster.setdiag((1.0 + self.lam) * adj_cluster.diagonal())
+            degree_matrix_diag = 1.0 / (np.asarray(adj_cluster.sum(axis=1)).ravel() + 1)
+            # Scale each row of the CSR data in place, equivalent to D^-1 A
+            adj_cluster.data *= np.repeat(
+                degree_matrix_diag, np.diff(adj_cluster.indptr)
+            )
+            # Diagonal enhancement, (1 + lam) * diag(D^-1 A)
+            adj_cluster.setdiag(adj_cluster.diagonal() + self.lam * degree_matrix_diag)
 
-        adj_cluster = adj_cluster.toarray()
+        return adj_cluster
 
-        g_node_list = list(g_cluster.nodes())
+    def _batch_adjacency(self, cluster_indices, node_indices):
+        """
+        Returns the adjacency matrix of a mini-batch, given the indices of its clusters
+        and of its nodes.
+        """
+        if self._cluster_cache is not None:
+            return self._cluster_cache[cluster_indices[0]]
+        else:
+            return self._cluster_adjacency(node_indices)
 
-        # Determine the target nodes that exist in this cluster
-        target_nodes_in_cluster = np.asanyarray(
-            list(set(g_node_list).intersection(self.target_ids))
-        )
+    def _cluster_batch(self, node_indices, adj_cluster):
+        """
+        Creates the model inputs and targets for the mini-batch of the given nodes.
 
-        self.__node_buffer[index] = target_nodes_in_cluster
+        This does not change the state of the sequence, so it can be called in parallel
+        for several mini-batches.
 
-        # Dictionary to store node indices for quicker node index lookups
-        node_lookup = dict(zip(g_node_list, range(len(g_node_list))))
+        Args:
+            node_indices (np.ndarray): The indices of the mini-batch nodes in the node
+                list of the graph
+            adj_cluster (sparse matrix): The adjacency matrix of the mini-batch nodes
 
-        # The list of indices of the target nodes in self.node_list
-        target_node_indices = np.array(
-            [node_lookup[n] for n in target_nodes_in_cluster]
-        )
+        Returns:
+            A tuple of the list of model inputs and the targets of the mini-batch (or
+            None if the sequence has no targets).
+        """
+        # Each output array is allocated once with its final shape, including the batch
+        # dimension, and filled in place. The arrays are not reused between mini-batches
+        # because Keras and tf.data may hold several mini-batches at the same time.
+        n_nodes = len(node_indices)
+        features = np.empty((1, n_nodes, self.features.shape[1]), dtype=np.float32)
+        np.take(self.features, node_indices, axis=0, out=features[0])
 
-        if index == (len(self.clusters_original) // self.q) - 1:
-            # last batch
-            self.__node_buffer_dict_to_list()
+        # The indices of the target nodes that exist in this cluster, in the cluster
+        target_node_indices = np.nonzero(self._is_target[node_indices])[0]
 
         cluster_targets = None
         #
         if self.targets is not None:
-            # Dictionary to store node indices for quicker node index lookups
-            # The list of indices of the target nodes in self.node_list
-            cluster_target_indices = np.array(
-                [self.target_node_lookup[n] for n in target_nodes_in_cluster]
-            )
+            # The list of indices of the target nodes in the targets array
+            cluster_target_indices = self._target_lookup[
+                node_indices[target_node_indices]
+            ]
             cluster_targets = self.targets[cluster_target_indices]
             cluster_targets = cluster_targets.reshape((1,) + cluster_targets.shape)
 
-        features = self.graph.get_feature_for_nodes(g_node_list)
-
-        features = np.reshape(features, (1,) + features.shape)
-        adj_cluster = adj_cluster.reshape((1,) + adj_cluster.shape)
         target_node_indices = target_node_indices[np.newaxis, np.newaxis, :]
 
-        return [features, target_node_indices, adj_cluster], cluster_targets
+        if self.use_sparse:
+            # Convert the CSR matrix to lists of indices & values of the non-zero entries,
+            # avoiding the dense N x N matrix for each mini-batch
+            adj_indices = np.empty((1, adj_cluster.nnz, 2), dtype=np.int64)
+            adj_indices[0, :, 0] = np.repeat(
+                np.arange(adj_cluster.shape[0]), np.diff(adj_cluster.indptr)
+            )
+            adj_indices[0, :, 1] = adj_cluster.indices
+            adj_values = adj_cluster.data[np.newaxis, :]
+            inputs = [features, target_node_indices, adj_indices, adj_values]
+        else:
+            adj_dense = np.zeros((1,) + adj_cluster.shape, dtype=np.float32)
+            adj_cluster.toarray(out=adj_dense[0])
+            inputs = [features, target_node_indices, adj_dense]
+
+        return inputs, cluster_targets
 
-    def __node_buffer_dict_to_list(self):
-        self.node_order = []
-        for k, v in self.__node_buffer.items():
-            self.node_order.extend(v)
+    def _target_nodes(self, node_indices):
+        """
+        Returns the IDs of the target nodes among the given nodes, in order.
+        """
+        return self._node_ids_array[node_indices[self._is_target[node_indices]]]
+
+    def __getitem__(self, index):
+        # The next batch should be the adjacency matrix for the cluster and the corresponding feature vectors
+        # and targets if available.
+        node_indices = self.clusters[index]
+        adj_cluster = self._batch_adjacency(
+            np.atleast_1d(self._cluster_indices[index]), node_indices
+        )
+
+        # Determine the target nodes that exist in this cluster
+        self.__node_buffer[index] = self._target_nodes(node_indices)
+
+        if index == (len(self.clusters_original) // self.q) - 1:
+            # last batch
+            self.__node_buffer_to_node_order()
+
+        return self._cluster_batch(node_indices, adj_cluster)
+
+    def to_dataset(self):
+        """
+        Creates a ``tf.data.Dataset`` of the mini-batches of this sequence, to use with
+        the Keras methods :meth:`keras.Model.fit`, :meth:`keras.Model.evaluate`, and
+        :meth:`keras.Model.predict`.
+
+        The nodes of each mini-batch are produced in order, and the adjacency matrices,
+        features and targets of several mini-batches are then prepared in parallel and
+        prefetched, so that this work overlaps with the model computation on the current
+        mini-batch. Each iteration over the dataset is one epoch of this sequence; the
+        clusters are shuffled at the end of each epoch and :attr:`node_order` is set to
+        the order of the target nodes in the epoch.
+
+        Returns:
+            A ``tf.data.Dataset`` with elements ``(inputs, targets)``, where ``inputs``
+            is a tuple of the model inputs. If the sequence has no targets, ``targets``
+            is an empty array of shape (1, 0).
+        """
+        n_features = self.features.shape[1]
+        input_types = (tf.float32, tf.int32)
+        input_shapes = ((1, None, n_features), (1, 1, None))
+        if self.use_sparse:
+            input_types += (tf.int64, tf.float32)
+            input_shapes += ((1, None, 2), (1, None))
+        else:
+            input_types += (tf.float32,)
+            input_shapes += ((1, None, None),)
+
+        # Keras requires dataset elements of models with several inputs to be
+        # (inputs, targets) pairs, so empty targets are given if there are none
+        if self.targets is not None:
+            target_type = tf.as_dtype(self.targets.dtype)
+            target_shape = (1, None) + self.targets.shape[1:]
+        else:
+            target_type = tf.float32
+            target_shape = (1, None)
+
+        output_types = input_types + (target_type,)
+        output_shapes = input_shapes + (target_shape,)
+
+        def batch_nodes():
+            # The nodes of each mini-batch are passed on so the mini-batches are not
+            # affected by the shuffle at the end of the epoch, which can happen before
+            # the last mini-batches are prepared.
+            node_order = []
+            for index in range(len(self)):
+                node_indices = self.clusters[index]
+                node_order.append(self._target_nodes(node_indices))
+                yield np.atleast_1d(self._cluster_indices[index]), node_indices
+
+            self.node_order = np.concatenate(node_order)
+            self.on_epoch_end()
+
+        def prepare_batch(cluster_indices, node_indices):
+            node_indices = node_indices.numpy()
+            adj_cluster = self._batch_adjacency(cluster_indices.numpy(), node_indices)
+            inputs, targets = self._cluster_batch(node_indices, adj_cluster)
+            if targets is None:
+                targets = np.zeros((1, 0), dtype=np.float32)
+
+            return [
+                np.asanyarray(x, dtype=t.as_numpy_dtype)
+                for x, t in zip(inputs + [targets], output_types)
+            ]
+
+        def prepare_batch_tensors(cluster_indices, node_indices):
+            tensors = tf.py_function(
+                prepare_batch, [cluster_indices, node_indices], output_types
+            )
+            for tensor, shape in zip(tensors, output_shapes):
+                tensor.set_shape(shape)
+            return tuple(tensors[:-1]), tensors[-1]
+
+        dataset = tf.data.Dataset.from_generator(
+            batch_nodes,
+            output_types=(tf.int64, tf.int64),
+            output_shapes=((None,), (None,)),
+        )
+        dataset = dataset.map(
+            prepare_batch_tensors, num_parallel_calls=tf.data.experimental.AUTOTUNE
+        )
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+    def __node_buffer_to_node_order(self):
+        # The target nodes in the order of the mini-batches, skipping any mini-batches
+        # that were not requested
+        self.node_order = np.concatenate(
+            [nodes for nodes in self.__node_buffer if nodes is not None]
+        )
 
     def on_epoch_end(self):
         """
          Shuffle all nodes at the end of each epoch
         """
+        cluster_indices = self._random_state.permutation(len(self.clusters_original))
+
+        # The indices of the nodes in each mini-batch of the epoch
         if self.q > 1:
             # combine clusters
-            cluster_indices = list(range(len(self.clusters_original)))
-            random.shuffle(cluster_indices)
-            self.clusters = []
-
-            for i in range(0, len(cluster_indices) - 1, self.q):
-                cc = cluster_indices[i : i + self.q]
-                tmp = []
-                for l in cc:
-                    tmp.extend(list(self.clusters_original[l]))
-                self.clusters.append(tmp)
+            self._cluster_indices = cluster_indices.reshape(-1, self.q)
+            self.clusters = [
+                np.concatenate([self._cluster_node_indices[l] for l in cc])
+                for cc in self._cluster_indices
+            ]
         else:
-            self.clusters = copy.deepcopy(self.clusters_original)
-
-        self.__node_buffer = dict()
+            self._cluster_indices = cluster_indices
+            self.clusters = [self._cluster_node_indices[l] for l in cluster_indices]
 
-        random.shuffle(self.clusters)
+        self.__node_buffer = [None] * len(self)
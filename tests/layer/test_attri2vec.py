@@ -98,7 +98,9 @@ def test_attri2vec_constructor():
     assert attri2vec.bias
 
 
-def test_attri2vec_apply():
+@pytest.fixture(scope="module")
+def attri2vec_case():
+    # The Attri2Vec object is shared by the tests that apply it in different ways
     attri2vec = Attri2Vec(
         layer_sizes=[2, 2, 2],
         bias=False,
@@ -109,44 +111,47 @@ def test_attri2vec_apply():
         normalize=None,
     )
 
+    x1 = np.array([[3, 1]])
+    x2 = np.array([[2]])
+    y1 = np.array([[16, 16]])
+    y2 = np.array([[1, 1]])
+
+    return attri2vec, x1, x2, y1, y2
+
+
+def unit_weight_model(xinp, xout):
+    model = keras.Model(inputs=xinp, outputs=xout)
+    model.set_weights([np.ones_like(w) for w in model.get_weights()])
+    return model
+
+
+@pytest.mark.parametrize("build_method", ["direct", "node_model"])
+def test_attri2vec_apply_node(attri2vec_case, build_method):
+    attri2vec = attri2vec_case[0]
+
     x = np.array([[1, 2]])
     expected = np.array([[12, 12]])
 
-    inp = keras.Input(shape=(2,))
-    out = attri2vec(inp)
-    model1 = keras.Model(inputs=inp, outputs=out)
-    model_weights1 = [np.ones_like(w) for w in model1.get_weights()]
-    model1.set_weights(model_weights1)
-    actual = model1.predict(x)
-    assert expected == pytest.approx(actual)
+    if build_method == "direct":
+        xinp = keras.Input(shape=(2,))
+        xout = attri2vec(xinp)
+    else:
+        # Use the node model:
+        xinp, xout = attri2vec.node_model()
 
-    # Use the node model:
-    xinp, xout = attri2vec.node_model()
-    model2 = keras.Model(inputs=xinp, outputs=xout)
-    model_weights2 = [np.ones_like(w) for w in model2.get_weights()]
-    model2.set_weights(model_weights2)
-    assert pytest.approx(expected) == model2.predict(x)
+    model = unit_weight_model(xinp, xout)
+    assert expected == pytest.approx(model.predict_on_batch(x))
 
-    x1 = np.array([[3, 1]])
-    x2 = np.array([[2]])
-    y1 = np.array([[16, 16]])
-    y2 = np.array([[1, 1]])
 
-    # Test the build function:
-    xinp, xout = attri2vec.build()
-    model3 = keras.Model(inputs=xinp, outputs=xout)
-    model_weights3 = [np.ones_like(w) for w in model3.get_weights()]
-    model3.set_weights(model_weights3)
-    actual = model3.predict([x1, x2])
-    assert pytest.approx(y1) == actual[0]
-    assert pytest.approx(y2) == actual[1]
+@pytest.mark.parametrize("build_method", ["build", "link_model"])
+def test_attri2vec_apply_link(attri2vec_case, build_method):
+    attri2vec, x1, x2, y1, y2 = attri2vec_case
+
+    # Test the build function or use the link model:
+    xinp, xout = getattr(attri2vec, build_method)()
 
-    # Use the link model:
-    xinp, xout = attri2vec.link_model()
-    model4 = keras.Model(inputs=xinp, outputs=xout)
-    model_weights4 = [np.ones_like(w) for w in model4.get_weights()]
-    model4.set_weights(model_weights4)
-    actual = model4.predict([x1, x2])
+    model = unit_weight_model(xinp, xout)
+    actual = model.predict_on_batch([x1, x2])
     assert pytest.approx(y1) == actual[0]
     assert pytest.approx(y2) == actual[1]
 
@@ -180,5 +185,5 @@ def test_attri2vec_serialize():
     x = np.array([[1, 2]])
     expected = np.array([[3, 3, 3, 3]])
 
-    actual = model2.predict(x)
+    actual = model2.predict_on_batch(x)
     assert expected == pytest.approx(actual)
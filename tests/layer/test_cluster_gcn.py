@@ -151,6 +151,86 @@ def test_ClusterGCN_apply():
     assert preds_2.shape == (1, 3, 2)
 
 
+def test_ClusterGCN_dataset():
+
+    G = create_stellargraph()
+
+    for sparse in [True, False]:
+        generator = ClusterNodeGenerator(G, clusters=[["a", "b"], ["c"]], sparse=sparse)
+
+        cluster_gcn_model = ClusterGCN(
+            layer_sizes=[2], generator=generator, activations=["relu"], dropout=0.0
+        )
+
+        x_in, x_out = cluster_gcn_model.build()
+        model = keras.Model(inputs=x_in, outputs=x_out)
+        model.compile(optimizer="adam", loss="mse")
+
+        targets = np.array([[0, 1], [1, 0], [1, 1]])
+        history = model.fit(
+            generator.flow(["a", "b", "c"], targets).to_dataset(), epochs=2, verbose=0
+        )
+        assert len(history.history["loss"]) == 2
+
+        # Predictions for a single cluster, which keeps the output shape of each batch
+        # the same
+        generator = ClusterNodeGenerator(G, clusters=1, sparse=sparse)
+        seq = generator.flow(["a", "b", "c"])
+        preds = model.predict_generator(seq)
+        preds_dataset = model.predict(seq.to_dataset())
+        assert preds_dataset == pytest.approx(preds)
+        assert len(seq.node_order) == 3
+
+        # Combined clusters are prepared from the nodes of each mini-batch, the
+        # predictions are in the order of node_order
+        generator = ClusterNodeGenerator(
+            G, clusters=[["a"], ["b", "c"]], q=2, sparse=sparse
+        )
+        seq = generator.flow(["a", "b", "c"])
+        preds = model.predict_generator(seq)
+        preds = dict(zip(seq.node_order, preds[0]))
+        preds_dataset = model.predict(seq.to_dataset())
+        preds_dataset = dict(zip(seq.node_order, preds_dataset[0]))
+        for node in ["a", "b", "c"]:
+            assert preds_dataset[node] == pytest.approx(preds[node])
+
+
+def test_ClusterGCN_apply_dense():
+
+    G = create_stellargraph()
+
+    # Use the same cluster so that both generators order the nodes in the same way
+    clusters = [["a", "b", "c"]]
+    generator = ClusterNodeGenerator(G, clusters=clusters, sparse=False)
+    generator_sparse = ClusterNodeGenerator(G, clusters=clusters, sparse=True)
+
+    cluster_gcn_model = ClusterGCN(
+        layer_sizes=[2], generator=generator, activations=["relu"], dropout=0.0
+    )
+    cluster_gcn_model_sparse = ClusterGCN(
+        layer_sizes=[2], generator=generator_sparse, activations=["relu"], dropout=0.0
+    )
+
+    x_in, x_out = cluster_gcn_model.build()
+    model = keras.Model(inputs=x_in, outputs=x_out)
+    assert len(x_in) == 3
+
+    x_in_sparse, x_out_sparse = cluster_gcn_model_sparse.build()
+    model_sparse = keras.Model(inputs=x_in_sparse, outputs=x_out_sparse)
+    assert len(x_in_sparse) == 4
+
+    # Use the same weights for both models
+    model_sparse.set_weights(model.get_weights())
+
+    # Check predict_generator method
+    preds = model.predict_generator(generator.flow(["a", "b", "c"]))
+    preds_sparse = model_sparse.predict_generator(
+        generator_sparse.flow(["a", "b", "c"])
+    )
+    assert preds.shape == (1, 3, 2)
+    assert preds_sparse == pytest.approx(preds)
+
+
 def test_ClusterGCN_activations():
 
     G = create_stellargraph()
@@ -50,6 +50,11 @@ def test_ClusterNodeSequence_init():
     nsg = ClusterNodeSequence(graph=G, clusters=[["a"], ["b", "d"], ["c"]])
     assert len(nsg) == 3
 
+    # the node indices and the adjacency matrix indices fit in int32
+    assert nsg.Aadj.indices.dtype == np.int32
+    assert nsg.Aadj.indptr.dtype == np.int32
+    assert all(c.dtype == np.int32 for c in nsg.clusters)
+
     # If targets are given, so should node_ids that correspond to these targets
     with pytest.raises(ValueError):
         ClusterNodeSequence(
@@ -76,7 +81,10 @@ def test_ClusterNodeSequence_getitem():
     G = create_stellargraph()
 
     nsg = ClusterNodeSequence(
-        graph=G, clusters=[["a"], ["b"], ["c"], ["d"]], node_ids=["a", "b", "d"]
+        graph=G,
+        clusters=[["a"], ["b"], ["c"], ["d"]],
+        node_ids=["a", "b", "d"],
+        sparse=False,
     )
 
     # 4 clusters with each cluster having a single node
@@ -86,6 +94,7 @@ def test_ClusterNodeSequence_getitem():
         print(cluster)
         assert len(cluster) == 2
         # [features, target_node_indices, adj_cluster], cluster_targets
+        assert len(cluster[0]) == 3
         assert len(cluster[0][0]) == 1
         assert len(cluster[0][1]) == 1
         assert cluster[0][2].shape == (
@@ -104,6 +113,240 @@ def test_ClusterNodeSequence_getitem():
 
     assert len(nodes.intersection(["a", "b", "d"])) == 3
 
+    nsg = ClusterNodeSequence(
+        graph=G, clusters=[["a"], ["b"], ["c"], ["d"]], node_ids=["a", "b", "d"]
+    )
+
+    for cluster in list(nsg):
+        assert len(cluster) == 2
+        # [features, target_node_indices, adj_indices, adj_values], cluster_targets
+        assert len(cluster[0]) == 4
+        assert len(cluster[0][0]) == 1
+        assert len(cluster[0][1]) == 1
+        # one node per cluster, the adjacency matrix has only the self loop
+        assert cluster[0][2].shape == (1, 1, 2)
+        assert cluster[0][3].shape == (1, 1)
+        assert cluster[1] is None  # no targets given
+
+    # the adjacency values of the cached cluster matrices cannot be changed
+    batch = nsg[0]
+    with pytest.raises(ValueError):
+        batch[0][3] *= 2
+
+
+def test_ClusterNodeSequence_targets():
+
+    G = create_stellargraph()
+
+    # Use the node features as targets so they can be checked against the batch features
+    node_ids = ["d", "a", "b"]
+    targets = G.get_feature_for_nodes(node_ids)
+
+    for q in [1, 2]:
+        nsg = ClusterNodeSequence(
+            graph=G,
+            clusters=[["a", "b"], ["c", "d"]],
+            node_ids=node_ids,
+            targets=targets,
+            q=q,
+        )
+
+        for batch in nsg:
+            features = batch[0][0][0]
+            target_node_indices = batch[0][1][0, 0]
+            assert batch[1][0] == pytest.approx(features[target_node_indices])
+
+        assert sorted(nsg.node_order) == sorted(node_ids)
+
+
+def test_ClusterNodeSequence_node_order():
+
+    G = create_stellargraph()
+
+    node_ids = ["a", "b", "c", "d"]
+    nsg = ClusterNodeSequence(
+        graph=G,
+        clusters=[["a"], ["b"], ["c"], ["d"]],
+        node_ids=node_ids,
+        targets=np.array([[0], [1], [2], [3]]),
+    )
+
+    # the node order follows the order of the mini-batches, not the order of the calls
+    batch_nodes = {}
+    # the node order is set when the last mini-batch is requested
+    for index in [2, 0, 1, 3]:
+        batch_nodes[index] = node_ids[nsg[index][1][0, 0, 0]]
+
+    assert list(nsg.node_order) == [batch_nodes[i] for i in range(len(nsg))]
+
+
+def test_ClusterNodeSequence_unknown_nodes():
+
+    G = create_stellargraph()
+
+    # target nodes and cluster nodes that are not in the graph are ignored
+    node_ids = ["a", "zz", "d"]
+    targets = np.array([[0], [1], [2]])
+    nsg = ClusterNodeGenerator(G, clusters=[["a", "b", "yy"], ["c", "d"]]).flow(
+        node_ids, targets
+    )
+
+    for batch in nsg:
+        assert batch[0][0].shape == (1, 2, 2)
+        assert batch[1].shape == (1, 1, 1)
+        # the target of each node is its row in the targets array
+        assert batch[1][0, 0, 0] in [0, 2]
+
+    assert sorted(nsg.node_order) == ["a", "d"]
+
+
+def test_ClusterNodeSequence_integer_node_ids():
+
+    Gnx = nx.Graph()
+    Gnx.add_nodes_from([10, 3, 7, 5])
+    Gnx.add_edges_from([(10, 3), (3, 7), (10, 7), (3, 5)])
+    node_features = pd.DataFrame(
+        np.array([[1, 1], [1, 0], [0, 1], [0.5, 1]]), index=[10, 3, 7, 5]
+    )
+    G = StellarGraph(Gnx, node_type_name="node", node_features=node_features)
+
+    node_ids = [5, 10, 3]
+    targets = G.get_feature_for_nodes(node_ids)
+    nsg = ClusterNodeSequence(
+        graph=G, clusters=[[10, 3], [7, 5]], node_ids=node_ids, targets=targets
+    )
+
+    for batch in nsg:
+        features = batch[0][0][0]
+        target_node_indices = batch[0][1][0, 0]
+        assert batch[1][0] == pytest.approx(features[target_node_indices])
+
+    assert sorted(nsg.node_order) == sorted(node_ids)
+
+    # Nodes that are not in the graph are ignored
+    nsg = ClusterNodeSequence(
+        graph=G, clusters=[[10, 3], [7, 4]], node_ids=[5, 10, 3, 7, 20]
+    )
+    assert [len(c) for c in nsg._cluster_node_indices] == [2, 1]
+    for batch in nsg:
+        pass
+    assert sorted(nsg.node_order) == [3, 7, 10]
+
+
+def test_ClusterNodeSequence_combine_clusters():
+
+    G = create_stellargraph()
+
+    nsg = ClusterNodeSequence(
+        graph=G,
+        clusters=[["a"], ["b"], ["c"], ["d"]],
+        node_ids=["a", "b", "c", "d"],
+        targets=np.array([[0], [1], [2], [3]]),
+        q=2,
+        sparse=False,
+    )
+
+    # 4 clusters combined in pairs
+    assert len(nsg) == 2
+
+    for epoch in range(2):
+        for batch in nsg:
+            # each batch has the features, target indices and adjacency of two nodes
+            assert batch[0][0].shape == (1, 2, 2)
+            assert batch[0][1].shape == (1, 1, 2)
+            assert batch[0][2].shape == (1, 2, 2)
+            assert batch[1].shape == (1, 2, 1)
+
+        assert len(nsg.node_order) == 4
+        assert set(nsg.node_order) == {"a", "b", "c", "d"}
+        nsg.on_epoch_end()
+
+
+@pytest.mark.parametrize("normalize_adj", [True, False])
+def test_ClusterNodeSequence_combined_adjacency(normalize_adj):
+
+    Gnx = nx.gnp_random_graph(30, 0.2, seed=42)
+    nodes = list(Gnx.nodes())
+    # The first feature is the node ID, to find the nodes of each mini-batch
+    node_features = pd.DataFrame(
+        np.column_stack([nodes, np.ones(len(nodes))]), index=nodes
+    )
+    G = StellarGraph(Gnx, node_type_name="node", node_features=node_features)
+
+    # Clusters of different sizes, combined in threes
+    clusters = [nodes[:3], nodes[3:10], nodes[10:12], nodes[12:20], nodes[20:26]]
+    clusters.append(nodes[26:])
+
+    lam = 0.1
+    nsg = ClusterNodeSequence(
+        graph=G,
+        clusters=clusters,
+        q=3,
+        normalize_adj=normalize_adj,
+        lam=lam,
+        sparse=False,
+    )
+
+    for batch in nsg:
+        batch_nodes = batch[0][0][0, :, 0].astype(int)
+        adj = batch[0][2][0]
+
+        # the edges within and between the combined clusters are included
+        expected = nx.to_numpy_array(Gnx, nodelist=batch_nodes)
+        if normalize_adj:
+            np.fill_diagonal(expected, 1)
+            expected /= expected.sum(axis=1, keepdims=True) + 1
+            expected[np.diag_indices_from(expected)] *= 1 + lam
+
+        assert adj == pytest.approx(expected)
+
+
+def test_ClusterNodeSequence_normalize_adj():
+
+    G = create_stellargraph()
+
+    lam = 0.1
+    # Nodes a, b, c form a triangle so the expected normalized adjacency matrix
+    # does not depend on the node ordering within the cluster.
+    nsg = ClusterNodeSequence(
+        graph=G, clusters=[["a", "b", "c"], ["d"]], lam=lam, sparse=False
+    )
+    nsg_sparse = ClusterNodeSequence(
+        graph=G, clusters=[["a", "b", "c"], ["d"]], lam=lam, sparse=True
+    )
+
+    for batch in nsg:
+        adj = batch[0][2][0]
+        n = adj.shape[0]
+        assert batch[0][0].dtype == np.float32
+        assert adj.dtype == np.float32
+        # self loop is included in the degree, plus one
+        expected = np.full((n, n), 1.0 / (n + 1))
+        np.fill_diagonal(expected, (1.0 + lam) / (n + 1))
+        assert adj == pytest.approx(expected)
+
+    for batch in nsg_sparse:
+        adj_indices = batch[0][2][0]
+        adj_values = batch[0][3][0]
+        assert adj_values.dtype == np.float32
+        n = batch[0][0].shape[1]
+        adj = np.zeros((n, n))
+        adj[adj_indices[:, 0], adj_indices[:, 1]] = adj_values
+        expected = np.full((n, n), 1.0 / (n + 1))
+        np.fill_diagonal(expected, (1.0 + lam) / (n + 1))
+        assert adj == pytest.approx(expected)
+
+    # Without normalization the adjacency matrix is returned as is
+    nsg = ClusterNodeSequence(
+        graph=G, clusters=[["a", "b", "c"], ["d"]], normalize_adj=False, sparse=False
+    )
+
+    for batch in nsg:
+        adj = batch[0][2][0]
+        n = adj.shape[0]
+        expected = np.ones((n, n)) - np.eye(n)
+        assert adj == pytest.approx(expected)
+
 
 def test_ClusterNodeGenerator_init():
 
@@ -153,6 +396,47 @@ def test_ClusterNodeGenerator_init():
         generator = ClusterNodeGenerator(G, clusters=1, q=1, lam=2.5)
 
 
+@pytest.mark.parametrize("q", [1, 2])
+def test_ClusterNodeGenerator_flow_shares_graph_data(q):
+
+    G = create_stellargraph()
+
+    cluster_gen = ClusterNodeGenerator(G, clusters=[["a", "b"], ["c", "d"]], q=q)
+    seq_1 = cluster_gen.flow(node_ids=["a", "b"])
+    seq_2 = cluster_gen.flow(node_ids=["c", "d"])
+
+    # the sequences reuse the node list, features and adjacency matrix of the generator
+    for seq in [seq_1, seq_2]:
+        assert seq.node_list is cluster_gen.node_list
+        assert seq.features is cluster_gen.features
+        assert seq.Aadj is cluster_gen.Aadj
+
+    # the features and adjacency matrix require the node list that gives their order
+    with pytest.raises(ValueError):
+        ClusterNodeSequence(
+            graph=G, clusters=[["a", "b", "c", "d"]], features=cluster_gen.features
+        )
+
+
+def test_ClusterNodeGenerator_seed():
+
+    G = create_stellargraph()
+
+    def node_orders(seed):
+        cluster_gen = ClusterNodeGenerator(G, clusters=4, q=2, seed=seed)
+        seq = cluster_gen.flow(node_ids=["a", "b", "c", "d"])
+        orders = []
+        for epoch in range(3):
+            for batch in seq:
+                pass
+            orders.append(list(seq.node_order))
+            seq.on_epoch_end()
+        return cluster_gen.clusters, orders
+
+    # the random clusters and the shuffling of the clusters are reproducible
+    assert node_orders(42) == node_orders(42)
+
+
 def test_ClusterNodeSquence():
 
     G = create_stellargraph()
@@ -172,6 +456,23 @@ def test_ClusterNodeSquence():
         node_ids=["a", "b", "c", "d"]
     )
 
+    # ClusterNodeSequence returns the following:
+    #      [features, target_node_indices, adj_indices, adj_values], cluster_targets
+    for batch in generator:
+        assert len(batch) == 2
+        # The first dimension is the batch dimension necessary to make this work with Keras
+        assert batch[0][0].shape == (1, 1, 2)
+        assert batch[0][1].shape == (1, 1, 1)
+        # one node so that the adjacency matrix has a single non-zero self loop
+        assert batch[0][2].shape == (1, 1, 2)
+        assert batch[0][3].shape == (1, 1)
+        # no targets given
+        assert batch[1] is None
+
+    generator = ClusterNodeGenerator(G, clusters=4, q=1, sparse=False).flow(
+        node_ids=["a", "b", "c", "d"]
+    )
+
     # ClusterNodeSequence returns the following:
     #      [features, target_node_indices, adj_cluster], cluster_targets
     for batch in generator:
@@ -185,7 +486,7 @@ def test_ClusterNodeSquence():
         assert batch[1] is None
 
     # Use 2 clusters
-    generator = ClusterNodeGenerator(G, clusters=2, q=1).flow(
+    generator = ClusterNodeGenerator(G, clusters=2, q=1, sparse=False).flow(
         node_ids=["a", "b", "c", "d"]
     )
     assert len(generator) == 2